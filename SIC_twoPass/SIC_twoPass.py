@@ -1,4 +1,28 @@
+import argparse
+import json
+import os
+import sqlite3
 import sys
+import tempfile
+
+# 序列化中間檔的格式名稱與版本；格式有不相容的修改時要把版本加一
+INTERMEDIATE_FORMAT = "sic-intermediate"
+INTERMEDIATE_VERSION = 1
+INTERMEDIATE_FILE = "passOne_output.json"
+
+# T record 打包策略：
+#   greedy  ：原本的作法，放不下下一筆目的碼就換新的 T record
+#   maxfill ：BYTE/WORD 這類資料可以拆到兩筆 T record，把每筆都塞滿
+PACK_STRATEGIES = ("greedy", "maxfill")
+DEFAULT_TEXT_RECORD_LENGTH = 30   # 標準 SIC loader 一筆 T record 最多 30 bytes
+MAX_TEXT_RECORD_LENGTH = 0xFF     # T record 的長度欄位只有 2 位 hex
+
+# 符號表的儲存方式：memory 為記憶體內的 dict，sqlite 存在磁碟上，給有上百萬個 label 的程式用
+SYMBOL_STORES = ("memory", "sqlite")
+SYMBOL_BATCH_SIZE = 10000  # sqlite 一次批次寫入/查詢的符號數量
+SYMBOL_DB_APPLICATION_ID = 0x53494331  # "SIC1"，標記資料庫是這個組譯器建立的符號表
+
+SPECIAL_MNEMONICS = {"START", "END", "WORD", "BYTE", "RESW", "RESB", "INCLUDE"}#特殊指令集
 
 # 全域變數，用於存儲程式的起始和結束位址
 program_start_address = 0
@@ -110,20 +134,371 @@ def validate_index_addressing(operand):
         return False, "索引定址格式錯誤 (逗號後只能接X)"
     return True, operand_norm  # 第二個回傳值改為「已經去空格+逗號處理過」的 operand_norm
 
+def validate_operand(mnemonic, operand):
+    """
+    依照 mnemonic 選擇對應的驗證函式，回傳它的 (是否合法, 錯誤訊息或正規化後的 operand)；
+    不需要驗證 operand 的指令回傳 None。
+    這些檢查和位址無關，所以在斷詞時就做好，INCLUDE 的檔案連同驗證結果一起快取。
+    """
+    if mnemonic == "BYTE":
+        return validate_byte_operand(operand)
+    if mnemonic == "WORD":
+        return validate_word_operand(operand)
+    if mnemonic == "RESW":
+        return validate_resw_operand(operand)
+    if mnemonic == "RESB":
+        return validate_resb_operand(operand)
+    if operand != '***' and ',' in operand: # 其他指令只要有逗號就要檢查索引定址
+        return validate_index_addressing(operand)
+    return None
+
+# ===================================================================================
+#                                  符號表 (symbol store)
+# ===================================================================================
+class MemorySymbolStore:
+    """
+    記憶體內的符號表：{label: 位址(int)}。
+    label 用 sys.intern 共用字串，位址直接存 int，不再存 4 個字元的 hex 字串。
+    """
+    def __init__(self):
+        self._symbols = {}
+
+    def define(self, label, addr, line=None):
+        """定義一個 label；已經定義過就回傳 False（重複定義）。line 只給 SQLiteSymbolStore 回報延後發現的重複用"""
+        if label in self._symbols:
+            return False
+        self._symbols[sys.intern(label)] = addr
+        return True
+
+    def take_duplicates(self):
+        """記憶體內的符號表在 define 時就會發現重複，不會有延後發現的重複定義"""
+        return []
+
+    def lookup_many(self, labels):
+        """一次查詢多個 label，回傳 {label: 位址}，未定義的 label 不會出現在結果裡"""
+        return {label: self._symbols[label] for label in labels if label in self._symbols}
+
+    def items(self):
+        """依定義順序列出 (label, 位址)"""
+        return iter(self._symbols.items())
+
+    def clear(self):
+        """清空符號表"""
+        self._symbols.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __contains__(self, label):
+        return label in self._symbols
+
+    def __getitem__(self, label):
+        return self._symbols[label]
+
+    def __len__(self):
+        return len(self._symbols)
+
+
+class SQLiteSymbolStore:
+    """
+    存在磁碟上的符號表，記憶體用量固定，不隨 label 數量成長。
+    passOne 定義的 label 先暫存在 _pending，滿 batch_size 筆才一次檢查重複並用 executemany 寫入；
+    所以和資料庫裡已有的 label 重複時，要到 flush 才會發現，由 take_duplicates() 取回。
+    產生目的碼時用 lookup_many 一次查一批 label。
+    沒有指定 path 時使用暫存檔，close() 時刪除。
+    指定 path 時只會使用空的（或不存在的）檔案，或是先前由這個組譯器建立的符號表資料庫，
+    其他資料庫丟出 ValueError，不是資料庫的檔案則由 sqlite3 丟出 sqlite3.DatabaseError。
+    """
+    def __init__(self, path=None, batch_size=SYMBOL_BATCH_SIZE):
+        self._temp_path = None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="sic_symbols_", suffix=".db")
+            os.close(fd)
+            self._temp_path = path
+        self._batch_size = batch_size
+        self._pending = {}  # 還沒寫進資料庫的 {label: (位址, 行號)}
+        self._duplicates = []  # flush 時才發現的重複定義 [(label, 行號)]
+        self._conn = sqlite3.connect(path)
+        try:
+            # 有資料表卻沒有我們的 application_id，就是別人的資料庫，不能把它的資料表刪掉
+            app_id = self._conn.execute("PRAGMA application_id").fetchone()[0]
+            has_tables = self._conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone() is not None
+            if has_tables and app_id != SYMBOL_DB_APPLICATION_ID:
+                raise ValueError(f"{path} 不是這個組譯器建立的符號表資料庫，為了避免覆蓋資料，不會使用這個檔案")
+        except (ValueError, sqlite3.Error):
+            self._conn.close()
+            raise
+        self._conn.execute(f"PRAGMA application_id={SYMBOL_DB_APPLICATION_ID}")
+        # 這只是組譯過程中的暫存資料，不需要 journal 和 fsync；cache 限制在約 8 MB
+        self._conn.execute("PRAGMA journal_mode=OFF")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("PRAGMA cache_size=-8192")
+        self._conn.execute("DROP TABLE IF EXISTS symbols")
+        # rowid 保留定義順序，label 的 UNIQUE 索引用來查詢
+        self._conn.execute("CREATE TABLE symbols (label TEXT NOT NULL UNIQUE, addr INTEGER NOT NULL)")
+
+    def define(self, label, addr, line=None):
+        """
+        定義一個 label；和這一批暫存的 label 重複時回傳 False。
+        和資料庫裡已有的 label 重複要到 flush 才知道，記在 take_duplicates() 裡（保留先定義的位址）。
+        """
+        if label in self._pending:
+            return False
+        self._pending[label] = (addr, line)
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+        return True
+
+    def take_duplicates(self):
+        """取回（並清空）flush 時才發現的重複定義 [(label, 行號)]"""
+        duplicates, self._duplicates = self._duplicates, []
+        return duplicates
+
+    def lookup_many(self, labels):
+        """一次查詢多個 label，回傳 {label: 位址}，未定義的 label 不會出現在結果裡"""
+        self.flush()
+        return self._select_many(labels)
+
+    def _select_many(self, labels):
+        """從資料庫查出 {label: 位址}，不含暫存中的 label"""
+        labels = list(set(labels))
+        found = {}
+        # SQLite 每條語句的參數數量有上限，所以分批查詢
+        for i in range(0, len(labels), 500):
+            chunk = labels[i:i+500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(f"SELECT label, addr FROM symbols WHERE label IN ({placeholders})", chunk)
+            found.update(rows)
+        return found
+
+    def items(self):
+        """依定義順序列出 (label, 位址)"""
+        self.flush()
+        return self._conn.execute("SELECT label, addr FROM symbols ORDER BY rowid")
+
+    def clear(self):
+        """清空符號表"""
+        self._pending = {}
+        self._duplicates = []
+        self._conn.execute("DELETE FROM symbols")
+        self._conn.commit()
+
+    def flush(self):
+        """把暫存的 label 批次寫進資料庫；整批只用 IN (...) 查一次哪些 label 已經存在"""
+        if self._pending:
+            existing = self._select_many(self._pending)
+            for label in existing:
+                self._duplicates.append((label, self._pending[label][1]))
+            self._conn.executemany("INSERT INTO symbols (label, addr) VALUES (?, ?)",
+                                   ((label, addr) for label, (addr, line) in self._pending.items()
+                                    if label not in existing))
+            self._conn.commit()
+            self._pending = {}
+
+    def close(self):
+        self._conn.close()
+        if self._temp_path is not None:
+            os.remove(self._temp_path)
+            self._temp_path = None
+
+    def __contains__(self, label):
+        if label in self._pending:
+            return True
+        return self._conn.execute("SELECT 1 FROM symbols WHERE label = ?", (label,)).fetchone() is not None
+
+    def __getitem__(self, label):
+        if label in self._pending:
+            return self._pending[label][0]
+        row = self._conn.execute("SELECT addr FROM symbols WHERE label = ?", (label,)).fetchone()
+        if row is None:
+            raise KeyError(label)
+        return row[0]
+
+    def __len__(self):
+        self.flush()
+        return self._conn.execute("SELECT COUNT(*) FROM symbols").fetchone()[0]
+
+
+def create_symbol_store(kind="memory", path=None):
+    """依照 kind 建立符號表；path 只對 sqlite 有用（不給就用暫存檔）"""
+    if kind == "memory":
+        return MemorySymbolStore()
+    if kind == "sqlite":
+        return SQLiteSymbolStore(path)
+    raise ValueError(f"未知的符號表類型 {kind} (可用: {', '.join(SYMBOL_STORES)})")
+
+
 # ===================================================================================
 #                                     passOne
 # ===================================================================================
-def passOne(file_path, opcode_table):
+def lex_line(raw_line, opcode_table):
+    """
+    把一行原始程式斷詞成 (label, mnemonic, operand, 錯誤訊息, operand 驗證結果)。
+    空白行、註解行回傳 None；格式錯誤時 label/mnemonic/operand 為 None，錯誤訊息不含行號，由 passOne 補上。
+    operand 驗證結果見 validate_operand。
+    只用到 opcode_table 的 key（判斷 token 是不是指令），所以也可以傳入 frozenset。
+    """
+    line = raw_line.rstrip('\n') # 移除換行符
+    parts = [] # 存分割後的token
+
+    # 忽略該行全空白或以 '.' 開頭的註解
+    if not line.strip() or line.strip().startswith('.'):
+        return None
+
+    # 去掉行內註解；單引號裡的 . 不算註解，例如 C'A.B' 或 INCLUDE 'lib/rdrec.asm'
+    in_quote = False
+    for i, c in enumerate(line):
+        if c == "'":
+            in_quote = not in_quote
+        elif c == '.' and not in_quote:
+            line = line[:i].rstrip() #以第一個引號外的 . 為切割點，取左邊那段（程式碼部份）。
+            break
+    if not line: #如果去掉註解和空白之後變空，那行就不用處理了
+        return None
+
+    # 按空白分割指令，但保留BYTE指令中的空格
+    line = line.strip()
+    if "BYTE" in line and ("C'" in line or "X'" in line):
+        # 先正常分割取得基本部分
+        parts = line.split()
+        # 找到BYTE指令的位置
+        byte_index = -1
+        for i, part in enumerate(parts):
+            if part == "BYTE":
+                byte_index = i
+                break
+        # 如果找到BYTE，重新處理其operand
+        if byte_index >= 0 and byte_index + 1 < len(parts):
+            operand_part = line.split("BYTE", 1)[1].strip()
+            parts = parts[:byte_index + 1]  # 保留到BYTE
+            parts.append(operand_part)  # 加入完整operand
+    else:
+        # 先用空格分割
+        parts = line.split()
+
+        # 檢查是否有索引定址（包含逗號的情況）
+        if len(parts) >= 2:  # 至少要有兩個部分才可能有索引定址
+            # 檢查最後兩個部分是否包含逗號
+            last_parts = ' '.join(parts[-2:])  # 合併最後兩個部分
+            if ',' in last_parts:  # 如果包含逗號
+                # 重新處理，保留前面的部分，並將最後帶有逗號的部分合併
+                base_parts = parts[:-2]  # 前面的部分
+                base_parts.append(last_parts)  # 加入合併後的最後部分
+                parts = base_parts
+
+    # 檢查欄位數量
+    if len(parts) > 3:
+        return None, None, None, "欄位數量超過限制", None
+
+    # ---------------------------
+    # 先判斷「第一個 token 是 MNEMONIC 還是 LABEL」
+    # 若 parts[0] 屬於 opcode_table 或 SPECIAL_MNEMONICS 或 == "RSUB"，就把它當作 mnemonic
+    # 否則就假設 parts[0] 是 label，parts[1] 要在 opcode_table 或 SPECIAL_MNEMONICS 或 == "RSUB"
+    # ---------------------------
+    label = '***'
+    mnemonic = '***'
+    operand = '***'
+
+    # 把所有 token 先轉成大寫比對，但保留原始大小寫以免 literal 出錯
+    upper0 = parts[0].upper() # 第一個token的大寫
+
+    if upper0 in opcode_table or upper0 in SPECIAL_MNEMONICS or upper0 == "RSUB":# 第一個就是 mnemonic
+        label = '***'
+        mnemonic = upper0 #如果第一個 token 本身就是已知指令，就把它當作 mnemonic
+
+        # 檢查欄位數量
+        if len(parts) > 2:
+            return None, None, None, "欄位數量超過限制", None
+
+        if len(parts) > 1:
+            # 檢查運算元是否為指令
+            operand_upper = parts[1].upper()
+            if operand_upper in opcode_table or operand_upper in SPECIAL_MNEMONICS or operand_upper == "RSUB":
+                return None, None, None, "運算元不可以是指令", None
+            operand = parts[1]  # 直接使用第二個token作為operand
+        else:
+            if mnemonic != "RSUB":  # RSUB不需要運算元
+                return None, None, None, "指令缺少運算元", None
+            operand = '***'
+
+    else: 
+        # parts[0] 當作 label，看 parts[1]
+        if len(parts) > 1:
+            upper1 = parts[1].upper()
+            if upper1 in opcode_table or upper1 in SPECIAL_MNEMONICS or upper1 == "RSUB":
+                label = parts[0]
+                mnemonic = upper1
+                # 檢查欄位數量
+                if len(parts) > 3:
+                    return None, None, None, "欄位數量超過限制", None
+
+                if len(parts) > 2:
+                    # 檢查運算元是否為指令
+                    operand_upper = parts[2].upper()
+                    if operand_upper in opcode_table or operand_upper in SPECIAL_MNEMONICS or operand_upper == "RSUB":
+                        return None, None, None, "運算元不可以是指令", None
+                    operand = parts[2]  # 直接使用第三個token作為operand
+                else:
+                    if mnemonic != "RSUB":  # RSUB不需要運算元
+                        return None, None, None, "指令缺少運算元", None
+                    operand = '***'
+            else:
+                # 既不是「第一個是 mnemonic」，也不是「第二個是 mnemonic」，視為 label-only 但下一行才接指令
+                # 把這個 label 記起來，暫時不把它存 symbol_table，等下一次真有 mnemonic 才補上
+                # 我們先把 num 跟 label 存進 intermediate，loc 先留空
+                # 但為了錯誤檢查流，我這裡直接略過這一行
+                return None, None, None, f"無效的 Opcode ({parts[0]})", None
+        else:
+            # 只有一個 token，但又不在 opcode_table 裡，視為「無效指令」
+            # 直接報錯、略過
+            return None, None, None, f"無效的指令 ({parts[0]})", None
+
+    return label, mnemonic, operand, None, validate_operand(mnemonic, operand)
+
+def lex_source(file_path, opcode_table):
+    """逐行斷詞，產生 (行號, (label, mnemonic, operand, 錯誤訊息, operand 驗證結果))，略過空白行和註解行"""
+    with open(file_path, 'r') as file:
+        for num, raw_line in enumerate(file, start=1):
+        # enumerate是一個內建函式，會把可迭代物件（這裡是 file）每個元素「打包」成 (index, element) 形式，依序回傳。
+        # num：會依序是 1、2、3…，代表當前讀到的行號。raw_line：是 file 第 num 行的原始文字（包含「\n」）。
+            lexed = lex_line(raw_line, opcode_table)
+            if lexed is not None:
+                yield num, lexed
+
+# INCLUDE 檔案的斷詞（含 operand 驗證）結果快取：{絕對路徑: ((mtime, 檔案大小, 指令集), [(行號, 斷詞結果), ...])}
+# 同一個 process 裡組譯多個原始程式時，共用的副程式檔只需要斷詞一次；每個路徑只留最新的一份
+_include_cache = {}
+
+def lex_source_cached(file_path, opcode_table):
+    """跟 lex_source 一樣，但結果依照檔案路徑和修改時間快取；檔案改過就重新斷詞，取代舊的快取"""
+    path = os.path.abspath(file_path)
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size, frozenset(opcode_table))
+    cached = _include_cache.get(path)
+    if cached is None or cached[0] != signature:
+        cached = (signature, list(lex_source(path, opcode_table)))
+        _include_cache[path] = cached
+    return cached[1]
+
+def passOne(file_path, opcode_table, symbol_table=None, output_file='passOne_output.txt'):
     """
+    INCLUDE '<檔案>' 會在該處把另一個原始檔的內容接進來（路徑相對於引入它的檔案），
+    被引入的檔案只斷詞一次（見 lex_source_cached），每次引入只重新分配位址和定義符號。
     passOne 會回傳：
-      symbol_table:   { label: address_hex, ... }
+      symbol_table:   符號表 (MemorySymbolStore / SQLiteSymbolStore)，label -> 位址(int)
       intermediate:   [[line_num, loc_hex, label, mnemonic, operand, opcode_hex, addressing], ...]
       operandConfirm: [[line_num, base_operand], ...]   （供 passTwo 檢查未定義符號）
       errorStatus:    [所有 passOne 時偵測到的錯誤訊息]
     """
     global program_start_address, program_end_address, program_end_loc, program_length  # 使用全域變數
-    
-    symbol_table = {}# 符號表：{標籤: 十六進位位址}
+    # 同一個 process 可能連續組譯多個程式，先把上一個程式留下的值清掉
+    program_start_address = program_end_address = program_end_loc = program_length = 0
+
+    if symbol_table is None: # 沒有指定就用記憶體內的符號表
+        symbol_table = MemorySymbolStore()# 符號表：{標籤: 位址}
     intermediate = []# 中間檔：[[行號, 位址, 標籤, 指令, 運算元, 指令碼, 定址方式], ...]
     errorStatus = []# 錯誤訊息：[所有 passOne 時偵測到的錯誤訊息]
     operandConfirm = []  # 待確認的 operand：[行號, 運算元]
@@ -131,134 +506,28 @@ def passOne(file_path, opcode_table):
     firstIn = False # 是否是第一行(是否已經開始處理指令)
     firstCommand = True # 是否是第一條指令
     loc = [0, 0]   # 位置計數器：[當前位址,下一個位址]
-    special = {"START", "END", "WORD", "BYTE", "RESW", "RESB"}#特殊指令集
     used_labels = set()# 已使用過的label
-
-    with open(file_path, 'r') as file, open('passOne_output.txt', 'w') as PassOne_output_file:
-        for num, raw_line in enumerate(file, start=1): 
-        # enumerate是一個內建函式，會把可迭代物件（這裡是 file）每個元素「打包」成 (index, element) 形式，依序回傳。
-        # num：會依序是 1、2、3…，代表當前讀到的行號。raw_line：是 file 第 num 行的原始文字（包含「\n」）。            
-            line = raw_line.rstrip('\n') # 移除換行符
-            parts = [] # 存分割後的token
-
-            # 忽略該行全空白或以 '.' 開頭的註解
-            if not line.strip() or line.strip().startswith('.'):
+    opcode_keys = frozenset(opcode_table) # 斷詞只需要知道哪些是指令
+
+    with open(output_file, 'w') as PassOne_output_file:
+        # 正在讀的檔案堆疊：[(顯示用的檔名, 絕對路徑, 逐行斷詞結果)]，碰到 INCLUDE 就把被引入的檔案推進來
+        # 主程式的行號用 int，被引入檔案的行號寫成 "檔名:行號"
+        sources = [(None, os.path.abspath(file_path), iter(lex_source(file_path, opcode_keys)))]
+        while sources:
+            source_name, source_path, lexed_lines = sources[-1]
+            entry = next(lexed_lines, None)
+            if entry is None: # 這個檔案讀完了，回到引入它的檔案
+                sources.pop()
                 continue
-
-            # 去掉行內註解
-            if '.' in line:
-                line = line.split('.', 1)[0].rstrip() #以第一個 . 為切割點，取左邊那段（程式碼部份）。
-                if not line: #如果去掉註解和空白之後變空，那行就不用處理了
-                    continue
-
-            # 按空白分割指令，但保留BYTE指令中的空格
-            line = line.strip()
-            if "BYTE" in line and ("C'" in line or "X'" in line):
-                # 先正常分割取得基本部分
-                parts = line.split()
-                # 找到BYTE指令的位置
-                byte_index = -1
-                for i, part in enumerate(parts):
-                    if part == "BYTE":
-                        byte_index = i
-                        break
-                # 如果找到BYTE，重新處理其operand
-                if byte_index >= 0 and byte_index + 1 < len(parts):
-                    operand_part = line.split("BYTE", 1)[1].strip()
-                    parts = parts[:byte_index + 1]  # 保留到BYTE
-                    parts.append(operand_part)  # 加入完整operand
-            else:
-                # 先用空格分割
-                parts = line.split()
-                
-                # 檢查是否有索引定址（包含逗號的情況）
-                if len(parts) >= 2:  # 至少要有兩個部分才可能有索引定址
-                    # 檢查最後兩個部分是否包含逗號
-                    last_parts = ' '.join(parts[-2:])  # 合併最後兩個部分
-                    if ',' in last_parts:  # 如果包含逗號
-                        # 重新處理，保留前面的部分，並將最後帶有逗號的部分合併
-                        base_parts = parts[:-2]  # 前面的部分
-                        base_parts.append(last_parts)  # 加入合併後的最後部分
-                        parts = base_parts
-
-            # 檢查欄位數量
-            if len(parts) > 3:
-                errorStatus.append(f"欄位數量超過限制 in line : {num}")
+            num, (label, mnemonic, operand, lex_error, checked) = entry
+            if source_name is not None:
+                num = f"{source_name}:{num}"
+            if lex_error:
+                errorStatus.append(f"{lex_error} in line : {num}")
                 continue
-
-            # ---------------------------
-            # 先判斷「第一個 token 是 MNEMONIC 還是 LABEL」
-            # 若 parts[0] 屬於 opcode_table 或 special 或 == "RSUB"，就把它當作 mnemonic
-            # 否則就假設 parts[0] 是 label，parts[1] 要在 opcode_table 或 special 或 == "RSUB"
-            # ---------------------------
-            label = '***'
-            mnemonic = '***'
-            operand = '***'
             opcode_hex = ''
             addressing = 'direct'
 
-            # 把所有 token 先轉成大寫比對，但保留原始大小寫以免 literal 出錯
-            upper0 = parts[0].upper() # 第一個token的大寫
-
-            if upper0 in opcode_table or upper0 in special or upper0 == "RSUB":# 第一個就是 mnemonic
-                label = '***'
-                mnemonic = upper0 #如果第一個 token 本身就是已知指令，就把它當作 mnemonic
-                
-                # 檢查欄位數量
-                if len(parts) > 2:
-                    errorStatus.append(f"欄位數量超過限制 in line : {num}")
-                    continue
-                
-                if len(parts) > 1:
-                    # 檢查運算元是否為指令
-                    operand_upper = parts[1].upper()
-                    if operand_upper in opcode_table or operand_upper in special or operand_upper == "RSUB":
-                        errorStatus.append(f"運算元不可以是指令 in line : {num}")
-                        continue
-                    operand = parts[1]  # 直接使用第二個token作為operand
-                else:
-                    if mnemonic != "RSUB":  # RSUB不需要運算元
-                        errorStatus.append(f"指令缺少運算元 in line : {num}")
-                        continue
-                    operand = '***'
-                
-            else: 
-                # parts[0] 當作 label，看 parts[1]
-                if len(parts) > 1:
-                    upper1 = parts[1].upper()
-                    if upper1 in opcode_table or upper1 in special or upper1 == "RSUB":
-                        label = parts[0]
-                        mnemonic = upper1
-                        # 檢查欄位數量
-                        if len(parts) > 3:
-                            errorStatus.append(f"欄位數量超過限制 in line : {num}")
-                            continue
-                        
-                        if len(parts) > 2:
-                            # 檢查運算元是否為指令
-                            operand_upper = parts[2].upper()
-                            if operand_upper in opcode_table or operand_upper in special or operand_upper == "RSUB":
-                                errorStatus.append(f"運算元不可以是指令 in line : {num}")
-                                continue
-                            operand = parts[2]  # 直接使用第三個token作為operand
-                        else:
-                            if mnemonic != "RSUB":  # RSUB不需要運算元
-                                errorStatus.append(f"指令缺少運算元 in line : {num}")
-                                continue
-                            operand = '***'
-                    else:
-                        # 既不是「第一個是 mnemonic」，也不是「第二個是 mnemonic」，視為 label-only 但下一行才接指令
-                        # 把這個 label 記起來，暫時不把它存 symbol_table，等下一次真有 mnemonic 才補上
-                        # 我們先把 num 跟 label 存進 intermediate，loc 先留空
-                        # 但為了錯誤檢查流，我這裡直接略過這一行
-                        errorStatus.append(f"無效的 Opcode ({parts[0]}) in line : {num}")
-                        continue
-                else:
-                    # 只有一個 token，但又不在 opcode_table 裡，視為「無效指令」
-                    # 直接報錯、略過
-                    errorStatus.append(f"無效的指令 ({parts[0]}) in line : {num}")
-                    continue
-
             # 標記第一次進入指令，之後就不是第一行
             if firstIn:
                 firstCommand = False # 標記不是第一條指令
@@ -285,13 +554,8 @@ def passOne(file_path, opcode_table):
 
                 # 如果有 label，就把 label 記到 symbol_table
                 if label != '***':
-                    if label in symbol_table: #如果在 symbol_table 已經見過同樣的 label
+                    if not symbol_table.define(label, loc[0], num): #把 label => loc[0] （起始位址）放入符號表；已經見過同樣的 label 就回傳 False
                         errorStatus.append(f"重複定義的標籤 {label} in line : {num}")
-                    else:
-                        symbol_table[label] = f"{loc[0]:04X}" #把 label => loc[0] （起始位址）放入符號表。
-                        # X 表示要把整數當做十六進位輸出，且字母用大寫（A-F）。
-                        # 4 表示寬度至少 4 個字元。
-                        # 0 表示如果不足 4 位，就在左邊補 0。
 
                 # 寫 intermediate：opcode_hex 用 '***' 佔位
                 intermediate.append([str(num), f"{loc[0]:04X}", label, "START", operand, "***", addressing])
@@ -299,15 +563,37 @@ def passOne(file_path, opcode_table):
                 # [行號,4位十六進位的位址,label,指令,運算元,opcode_hex 佔位(因為 START 不會產生機械碼),定址方式]
 
             # Pass 1 中，對每一行中間檔的封裝前，做一些「結構性檢查」和「特殊指令處理」。
+            # 被引入的檔案只能放副程式和資料，程式的開始和結束由主程式決定
+            if source_name is not None and mnemonic in ("START", "END"):
+                errorStatus.append(f"INCLUDE 的檔案不能有 {mnemonic} 指令 in line : {num}")
+                continue
+
             # ---------------------------
             # 檢查 label 重複
             # ---------------------------
             if label != '***': #實際有定義一個 Label
-                if label in symbol_table:
+                if not symbol_table.define(label, loc[0], num):
                     errorStatus.append(f"重複定義的標籤 {label} in line : {num}")
-                else:
-                    symbol_table[label] = f"{loc[0]:04X}"
                     # 在 Pass 1 時，一旦看到某個標籤，就把它記下來；若同一個標籤出現第二次，就馬上報錯，防止以後生成 object code 時地址對不上。
+
+            # ---------------------------
+            # 處理 INCLUDE：把另一個原始檔的內容接在這裡
+            # ---------------------------
+            if mnemonic == "INCLUDE":
+                # INCLUDE 本身不佔空間，也不產生機械碼，只記在中間檔方便對照
+                intermediate.append([str(num), f"{loc[0]:04X}", label, "INCLUDE", operand, "***", addressing])
+                include_name = operand.strip("'") # 檔名有 . 時要用單引號括起來，否則會被當成註解
+                include_path = os.path.abspath(os.path.join(os.path.dirname(source_path), include_name)) # 相對於引入它的檔案
+                if any(include_path == path for _, path, _ in sources): # 檔案 A 引入 B、B 又引入 A 會無限展開
+                    errorStatus.append(f"INCLUDE 的檔案 {include_name} 形成循環引入 in line : {num}")
+                    continue
+                try:
+                    included = lex_source_cached(include_path, opcode_keys) # 斷詞結果有快取，同一個檔案只讀一次
+                except OSError:
+                    errorStatus.append(f"找不到 INCLUDE 的檔案 {include_name} in line : {num}")
+                    continue
+                sources.append((include_name, include_path, iter(included)))
+                continue
             # ---------------------------
             # 檢查無效的 mnemonic
             # ---------------------------
@@ -344,7 +630,7 @@ def passOne(file_path, opcode_table):
             # 處理 BYTE / WORD / RESW / RESB
             # ---------------------------
             if mnemonic == "BYTE":
-                valid, msg = validate_byte_operand(operand) #驗證 BYTE 指令的運算元格式：是X'偶數個16進位數字'或C'...'，且內容不能為空
+                valid, msg = checked #斷詞時已用 validate_byte_operand 驗證 BYTE 指令的運算元格式：是X'偶數個16進位數字'或C'...'，且內容不能為空
                 if not valid: #BYTE指令格式不對
                     errorStatus.append(f"{msg} in line : {num}")
                     size = 0 #後面不移動 LOCCTR
@@ -395,7 +681,7 @@ def passOne(file_path, opcode_table):
 
             #固定 3 bytes，對應放一個整數常數。
             if mnemonic == "WORD":
-                valid, msg = validate_word_operand(operand) #驗證 WORD 指令的運算元，必須能轉換為十進位數字,且不能為空
+                valid, msg = checked #斷詞時已用 validate_word_operand 驗證 WORD 指令的運算元，必須能轉換為十進位數字,且不能為空
                 if not valid:
                     errorStatus.append(f"{msg} in line : {num}")
                     size = 0 #後面不移動 LOCCTR
@@ -410,7 +696,7 @@ def passOne(file_path, opcode_table):
 
             # 保留 n 個 word    
             if mnemonic == "RESW":
-                valid, msg = validate_resw_operand(operand) #驗證 RESW 指令的運算元，必須能轉換為十進位數字,且不能為空
+                valid, msg = checked #斷詞時已用 validate_resw_operand 驗證 RESW 指令的運算元，必須能轉換為十進位數字,且不能為空
                 if not valid:
                     errorStatus.append(f"{msg} in line : {num}")
                     size = 0 
@@ -423,7 +709,7 @@ def passOne(file_path, opcode_table):
 
             #保留 n 個 byte。
             if mnemonic == "RESB":
-                valid, msg = validate_resb_operand(operand) #驗證 RESB 指令的運算元，必須能轉換為十進位數字,且不能為空
+                valid, msg = checked #斷詞時已用 validate_resb_operand 驗證 RESB 指令的運算元，必須能轉換為十進位數字,且不能為空
                 if not valid:
                     errorStatus.append(f"{msg} in line : {num}")
                     size = 0
@@ -443,7 +729,7 @@ def passOne(file_path, opcode_table):
             is_indexed = False #之後若檢測到有索引定址就設 True。
             # 處理「一般指令」（非 START/END/BYTE/WORD/RESW/RESB/RSUB）並支援索引定址（,）
             if operand != '***' and ',' in operand: #當 operand 不是佔位 *** 且字串內含逗號才處理。
-                valid_idx, normalized = validate_index_addressing(operand) #會去除多餘空格，確認格式合法（只有一個逗號、逗號後是 X），並回傳 (True, "BUFFER,X") 或 (False, 錯誤訊息).
+                valid_idx, normalized = checked #斷詞時已用 validate_index_addressing 驗證：會去除多餘空格，確認格式合法（只有一個逗號、逗號後是 X），並回傳 (True, "BUFFER,X") 或 (False, 錯誤訊息).
                 if not valid_idx: # 格式錯
                     errorStatus.append(f"{normalized} in line : {num}" if "索引定址格式錯誤" in normalized else f"{normalized} in line : {num}")
                     # 格式錯就把這行「照原樣」先塞進中間檔（opcode_hex 用 *** 佔位），再跳下一行
@@ -510,8 +796,13 @@ def passOne(file_path, opcode_table):
         print(f"Program Length: {program_length:04X}")    # 程式長度（用於 H record）
         print("-" * 30)
 
+        symbol_table.flush() # 把還在暫存的 label 寫進符號表（sqlite 才有作用）
+        # sqlite 符號表是整批檢查重複，有些重複定義到 flush 才發現
+        for label, num in symbol_table.take_duplicates():
+            errorStatus.append(f"重複定義的標籤 {label} in line : {num}")
+
         return symbol_table, intermediate, operandConfirm, errorStatus
-        # symbol_table：Pass 1 建好的標籤→位址對照表。 { label: address_hex, ... }
+        # symbol_table：Pass 1 建好的標籤→位址對照表。 { label: address, ... }
         # intermediate：中間檔，用於讓 Pass 2 生成 Object Code。 [[line_num, loc_hex, label, mnemonic, operand, opcode_hex, addressing], ...]
         # operandConfirm：紀錄所有 operand 中看起來像符號（在symbol_table 裡已定義的label），需要在 Pass 2 去 symbol_table 裡確認的清單。[[line_num, base_operand], ...]
         # errorStatus：所有在 Pass 1 發現的錯誤訊息，Pass 2 可以繼續補檢符號之後一次印完。
@@ -520,6 +811,221 @@ def passOne(file_path, opcode_table):
         # 操作數（operand）指的是 指令後面跟的那一塊字串，比如 LDA BUFFER,X 中的 BUFFER,X，或 JEQ LOOP 中的 LOOP。
 
 
+# ===================================================================================
+#                               中間檔序列化 (passOne -> passTwo)
+# ===================================================================================
+def save_intermediate(path, symbol_table, intermediate, operandConfirm, errorStatus):
+    """
+    把 passOne 的結果寫成可以讀回的 JSON 中間檔。
+    passOne_output.txt 只是給人看的（label 用 *** 佔位、C'A B' 內有空格，無法可靠地讀回），
+    這個檔案則包含 passTwo 需要的全部資訊，讓 passTwo 可以不重跑 passOne 直接開始。
+    """
+    program = {
+        "start_address": program_start_address,
+        "end_address": program_end_address,
+        "end_loc": program_end_loc,
+        "length": program_length,
+    }
+
+    def dumps(value):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':')) # 不留多餘空白，讓檔案盡量小
+
+    def write_list(f, rows):
+        f.write('[')
+        for i, row in enumerate(rows):
+            if i:
+                f.write(',')
+            f.write(dumps(row))
+        f.write(']')
+
+    # 符號表和中間檔逐筆寫出，不另外組一個完整的 dict/list 再一次 json.dump；
+    # sqlite 符號表是直接從資料庫一筆筆讀出來寫，不會整個載入記憶體
+    with open(path, 'w') as f:
+        f.write(f'{{"format":{dumps(INTERMEDIATE_FORMAT)},"version":{INTERMEDIATE_VERSION},"program":{dumps(program)},"symbol_table":{{')
+        for i, (label, addr) in enumerate(symbol_table.items()):
+            if i:
+                f.write(',')
+            f.write(f'{dumps(label)}:"{addr:04X}"')
+        f.write('},"intermediate":')
+        write_list(f, intermediate)
+        f.write(',"operand_confirm":')
+        write_list(f, operandConfirm)
+        f.write(',"errors":')
+        write_list(f, errorStatus)
+        f.write('}')
+
+def load_intermediate(path, symbol_table=None):
+    """
+    讀回 save_intermediate 寫出的中間檔，並還原程式起始/結束位址與長度等全域變數。
+    符號會放進 symbol_table（沒有指定就用 MemorySymbolStore）。
+    回傳值與 passOne 相同：(symbol_table, intermediate, operandConfirm, errorStatus)
+    格式或版本不符、欄位缺少或型態不對時丟出 ValueError。
+    """
+    global program_start_address, program_end_address, program_end_loc, program_length
+
+    with open(path, 'r') as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"中間檔 {path} 不是有效的 JSON: {e}")
+
+    if not isinstance(data, dict) or data.get("format") != INTERMEDIATE_FORMAT:
+        raise ValueError(f"{path} 不是 passOne 產生的中間檔")
+    if data.get("version") != INTERMEDIATE_VERSION:
+        raise ValueError(f"中間檔版本 {data.get('version')} 不支援 (目前版本為 {INTERMEDIATE_VERSION})，請重新執行 passOne")
+
+    # 格式和版本都對，但欄位缺少或型態不對（例如檔案被手動修改過），一樣當成無效的中間檔
+    invalid = f"中間檔 {path} 內容不完整或已損壞，請重新執行 passOne"
+    program = data.get("program")
+    if not isinstance(program, dict) or \
+       not all(isinstance(program.get(key), int) for key in ("start_address", "end_address", "end_loc", "length")):
+        raise ValueError(invalid)
+    symbols = data.get("symbol_table")
+    if not isinstance(symbols, dict) or \
+       not all(isinstance(addr_hex, str) and is_valid_hex(addr_hex) for addr_hex in symbols.values()):
+        raise ValueError(invalid)
+    intermediate = data.get("intermediate")
+    if not isinstance(intermediate, list) or \
+       not all(isinstance(record, list) and len(record) == 7 and all(isinstance(field, str) for field in record)
+               for record in intermediate):
+        raise ValueError(invalid)
+    operandConfirm = data.get("operand_confirm")
+    if not isinstance(operandConfirm, list) or \
+       not all(isinstance(entry, list) and len(entry) == 2 and isinstance(entry[1], str) for entry in operandConfirm):
+        raise ValueError(invalid)
+    errors = data.get("errors")
+    if not isinstance(errors, list) or not all(isinstance(e, str) for e in errors):
+        raise ValueError(invalid)
+
+    program_start_address = program["start_address"]
+    program_end_address = program["end_address"]
+    program_end_loc = program["end_loc"]
+    program_length = program["length"]
+
+    if symbol_table is None:
+        symbol_table = MemorySymbolStore()
+    for label, addr_hex in symbols.items():
+        symbol_table.define(label, int(addr_hex, 16))
+    symbol_table.flush()
+
+    # JSON 只有 list，operandConfirm 的 [行號, 運算元] 讀回來仍是 list；行號維持原本的 int 或 "檔名:行號" 字串
+    return symbol_table, intermediate, operandConfirm, errors
+
+
+# ===================================================================================
+#                             無用程式碼/資料消除 (選用)
+# ===================================================================================
+DATA_MNEMONICS = {"BYTE", "WORD", "RESW", "RESB"}
+ALWAYS_KEPT = {"START", "END", "INCLUDE"} # 不佔空間的標記，一定保留
+NO_FALL_THROUGH = {"J", "RSUB"} # 執行完不會接著執行下一行的指令
+
+def eliminate_unreachable(symbol_table, intermediate, operandConfirm):
+    """
+    從 END 指定的執行入口出發，沿著「往下一行執行」和 operandConfirm 記錄的符號參照，
+    找出所有用得到的中間檔記錄；沒有人參照的副程式和 RESW/RESB 等資料會被刪除，
+    剩下的記錄重新分配位址並重建符號表。
+    回傳 (新的 intermediate, 新的 operandConfirm, 省下的 bytes)。
+
+    往下一行的規則：
+      - J、RSUB 之後不會往下執行
+      - 資料 (BYTE/WORD/RESW/RESB) 只延續到下一筆「沒有 label 的資料」（例如被切段的長 BYTE 或連續的表格）
+      - 其他指令都會往下一行執行
+    注意：用索引定址從一個 label 的資料讀到另一個 label 的資料時，後者會被當成沒人用而刪掉。
+    """
+    global program_end_address, program_end_loc, program_length
+
+    count = len(intermediate)
+    label_index = {} # label -> 定義它的中間檔記錄
+    for i, record in enumerate(intermediate):
+        if record[2] != '***':
+            label_index[record[2]] = i
+
+    # operandConfirm 的行號是 int（主程式）或 "檔名:行號"（INCLUDE 進來的），中間檔裡則一律是字串
+    references = {} # 行號 -> 這行參照到的符號
+    for ln, sym in operandConfirm:
+        references.setdefault(str(ln), []).append(sym.split(',')[0]) # 索引定址 "BUFFER,X" 只看 "BUFFER"
+
+    # 找執行入口：END 的運算元；沒有定義就從 START 的下一行開始
+    end_index = next((i for i, record in enumerate(intermediate) if record[3] == "END"), None)
+    start_index = next((i for i, record in enumerate(intermediate) if record[3] == "START"), None)
+    entry = None
+    if end_index is not None:
+        entry = label_index.get(intermediate[end_index][4])
+    if entry is None and start_index is not None and start_index + 1 < count:
+        entry = start_index + 1
+
+    live = [False] * count
+    worklist = [entry] if entry is not None else []
+    while worklist:
+        i = worklist.pop()
+        if live[i]:
+            continue
+        live[i] = True
+        line_num, loc_hex, label, mnemonic, operand, opcode_hex, addressing = intermediate[i]
+
+        # 這行參照到的符號所在的記錄都用得到
+        for sym in references.get(line_num, []):
+            target = label_index.get(sym)
+            if target is not None and not live[target]:
+                worklist.append(target)
+
+        # 往下一行執行（或資料延續到下一筆）
+        nxt = i + 1
+        if nxt >= count or live[nxt] or mnemonic in NO_FALL_THROUGH:
+            continue
+        if mnemonic in DATA_MNEMONICS and (intermediate[nxt][2] != '***' or intermediate[nxt][3] not in DATA_MNEMONICS):
+            continue
+        worklist.append(nxt)
+
+    # 每筆記錄佔的大小直接用 passOne 算好的位址差，END 的位址就是最後一筆的結尾
+    new_intermediate = []
+    removed_labels = []
+    kept_lines = set()
+    loc = program_start_address
+    for i, record in enumerate(intermediate):
+        if i + 1 < count:
+            size = int(intermediate[i + 1][1], 16) - int(record[1], 16)
+        else:
+            size = 0
+        if not live[i] and record[3] not in ALWAYS_KEPT: # START/END/INCLUDE 一定保留
+            if record[2] != '***':
+                removed_labels.append(record[2])
+            continue
+        kept_lines.add(record[0])
+        new_record = list(record)
+        if record[3] != "START": # START 的位址就是程式起始位址，不用動
+            new_record[1] = f"{loc:04X}"
+            loc += size
+        new_intermediate.append(new_record)
+
+    # 用新的位址重建符號表
+    symbol_table.clear()
+    for record in new_intermediate:
+        if record[2] != '***':
+            symbol_table.define(record[2], int(record[1], 16))
+    symbol_table.flush()
+
+    # 刪掉的記錄裡的符號參照也不用再檢查（同一行切成多筆記錄時，只要有一筆留下就保留）
+    new_operandConfirm = [[ln, sym] for ln, sym in operandConfirm if str(ln) in kept_lines]
+
+    old_length = program_length
+    end_record = next((record for record in new_intermediate if record[3] == "END"), None)
+    if end_record is not None:
+        program_end_loc = int(end_record[1], 16)
+    program_end_address = min(program_end_address, program_end_loc)
+    program_length = program_end_loc - program_start_address
+    saved = old_length - program_length
+
+    print("\n==== Dead Code Elimination ====")
+    print(f"Removed Records: {count - len(new_intermediate)}")
+    print(f"Removed Labels: {', '.join(removed_labels) if removed_labels else '(none)'}")
+    print(f"Program Length: {old_length:04X} -> {program_length:04X}")
+    print(f"Bytes Saved: {saved}")
+    print("-" * 30)
+
+    return new_intermediate, new_operandConfirm, saved
+
+
 # ===================================================================================
 #                                     passTwo
 # ===================================================================================
@@ -546,29 +1052,123 @@ def generate_object_code(operand, opcode, symbol_table, addressing):
     # operand 裡有逗號，格式通常是 LABEL,X。
     if ',' in operand:  # 索引定址
         base_addr = operand.split(',')[0] # 取逗號前面真正的符號名稱，例如 "BUFFER,X" → "BUFFER"。
-        if base_addr in symbol_table: # 若從 symbol_table 拿到那個符號的十六進位地址（hex 字串）
-             #symbol_table[base_addr] 拿到的是一個字串，例如 "0039"，表示符號在中間檔裡算出的十六進位位址。
-            addr = int(symbol_table[base_addr], 16) # 轉成十進位整數     
+        if base_addr in symbol_table: # 若從 symbol_table 拿到那個符號的位址
+            addr = symbol_table[base_addr] #symbol_table[base_addr] 拿到的是整數位址，例如 0x1039。
             # 0x8000 的二進位是 1000 0000 0000 0000₂ # Set X bit (bit 15) to 1 ＝加上 0x8000，把 index 位元（最高位）打開。
             return f"{opcode}{addr + 0x8000:04X}"  # 再把 opcode（兩位 hex）和這個 16 位位址拼成 6 位 hex 串回傳。
             # 先把 symbol_table裡記錄的十六進位地址轉成整數，加上 0x8000 來開啟 X-bit（索引定址旗標），然後用 f-string 格式化成 4 位大寫 hex，再拼在兩位 Opcode 之後，得到最終的 6 位十六進位機器碼。
 
 
     elif operand in symbol_table:  # 直接定址
-        addr = int(symbol_table[operand], 16) # 如果 operand 是一個已定義的符號，就取它位址
+        addr = symbol_table[operand] # 如果 operand 是一個已定義的符號，就取它位址
         return f"{opcode}{addr:04X}" # 直接拼成 opcode + address。
     elif is_valid_decimal(operand):  # 立即值(Immediate value)
         return f"{opcode}{int(operand):04X}" # 如果 operand 看起來是純十進位數字（is_valid_decimal 回 True），就把它當作一個立即數，加在 opcode 後面，轉成 4 位 hex。
     #沒有在symbol table 就報錯
     return None #上面所有情況都不符，就回 None，代表這行不生成 object code（或是格式錯誤留給 Pass 2 後續處理）。
 
-def generate_object_program(symbol_table, intermediate):
-    """產生目的碼"""
+def format_text_record(start_addr, length, codes):
+    """組出一筆 T record，目的碼之間用空格隔開"""
+    return f"T {start_addr:06X} {length:02X} {' '.join(codes)}"
+
+def pack_text_records(text_codes, strategy="greedy", max_record_length=DEFAULT_TEXT_RECORD_LENGTH):
+    """
+    把依位址排好的 [(位址, 目的碼hex, 可否拆開), ...] 打包成 T record。
+    只有位址真的接不上（例如 RESW/RESB 保留了空間）時才結束目前這筆 T record，
+    RESB 0 這類不佔空間的保留不會把 T record 切斷。
+    用 current_length 記錄目前這筆已經累積的 bytes，不必每次重新加總 current_text。
+    """
+    if strategy not in PACK_STRATEGIES:
+        raise ValueError(f"未知的 T record 打包策略 {strategy} (可用: {', '.join(PACK_STRATEGIES)})")
+    if not 3 <= max_record_length <= MAX_TEXT_RECORD_LENGTH: # 至少要放得下一條 3 bytes 的指令
+        raise ValueError(f"T record 長度必須介於 3 到 {MAX_TEXT_RECORD_LENGTH} bytes，不能是 {max_record_length}")
+
+    text_records = []
+    current_text = []
+    current_start_addr = None
+    current_length = 0 # 目前這筆 T record 已累積的 bytes
+
+    for addr, obj_code, splittable in text_codes:
+        # 空隙：這筆目的碼的位址接不上目前這筆 T record 的結尾，先把已累積的目的碼 flush 成一筆 T record
+        if current_text and addr != current_start_addr + current_length:
+            text_records.append(format_text_record(current_start_addr, current_length, current_text))
+            current_text = []
+            current_start_addr = None
+            current_length = 0
+
+        obj_code = obj_code.replace(" ", "")
+        code_length = len(obj_code) // 2 # 每 2 個 hex 字元才是 1 byte
+
+        # maxfill：資料放不下時，把剩下的空間塞滿，其餘的接到下一筆 T record
+        if strategy == "maxfill" and splittable:
+            while current_length + code_length > max_record_length:
+                room = max_record_length - current_length
+                if room > 0:
+                    if current_start_addr is None:
+                        current_start_addr = addr
+                    current_text.append(obj_code[:room * 2])
+                    current_length += room
+                    obj_code = obj_code[room * 2:]
+                    addr += room
+                    code_length -= room
+                text_records.append(format_text_record(current_start_addr, current_length, current_text))
+                current_text = []
+                current_start_addr = None
+                current_length = 0
+            if code_length == 0:
+                continue
+
+        # greedy：資料本身就比 max_record_length 長時（passOne 以 30 bytes 切段），
+        # 先結束目前這筆，再切成一筆筆剛好 max_record_length 的 T record，剩下的留給下一筆
+        if splittable and code_length > max_record_length:
+            if current_text:
+                text_records.append(format_text_record(current_start_addr, current_length, current_text))
+            while code_length > max_record_length:
+                text_records.append(format_text_record(addr, max_record_length, [obj_code[:max_record_length * 2]]))
+                obj_code = obj_code[max_record_length * 2:]
+                addr += max_record_length
+                code_length -= max_record_length
+            current_text = []
+            current_start_addr = None
+            current_length = 0
+
+        # greedy（或不能拆的指令）：放不下就先 flush，這筆放到新的 T record
+        if current_text and current_length + code_length > max_record_length:
+            text_records.append(format_text_record(current_start_addr, current_length, current_text))
+            current_text = []
+            current_start_addr = None
+            current_length = 0
+
+        # 這筆 T record 剛開始，就把這行的位址當成起始位址
+        if current_start_addr is None:
+            current_start_addr = addr
+        current_text.append(obj_code)
+        current_length += code_length
+
+    # Output final text record if any
+    if current_text:
+        text_records.append(format_text_record(current_start_addr, current_length, current_text))
+
+    return text_records
+
+def iter_with_symbols(intermediate, symbol_table, batch_size=SYMBOL_BATCH_SIZE):
+    """
+    每 batch_size 筆中間檔記錄，用 lookup_many 一次查好這批用到的符號，
+    逐筆回傳 (record, {label: 位址})，避免 sqlite 符號表每行都查一次。
+    """
+    for i in range(0, len(intermediate), batch_size):
+        batch = intermediate[i:i+batch_size]
+        # record[4] 是 operand，索引定址 "BUFFER,X" 只需要查 "BUFFER"
+        labels = {record[4].split(',')[0] for record in batch if record[5] != '***'}
+        symbols = symbol_table.lookup_many(labels)
+        for record in batch:
+            yield record, symbols
+
+def generate_object_program(symbol_table, intermediate, strategy="greedy", max_record_length=DEFAULT_TEXT_RECORD_LENGTH):
+    """產生目的碼，strategy / max_record_length 決定 T record 的打包方式"""
     global program_start_address, program_length, program_end_address  # 使用全域變數
     
     object_records = []
-    current_text = []
-    current_start_addr = None
 
     # 找到程式名稱（START 那行的 label）
     program_name = "PROG"  # 預設名稱
@@ -586,65 +1186,34 @@ def generate_object_program(symbol_table, intermediate):
     entry_point = program_start_address  # 預設執行入口
     if end_record and end_record[4] != '***': #找到了 END 且 operand（欄位 [4]）不是佔位 ***：
         if end_record[4] in symbol_table:
-            entry_point = int(symbol_table[end_record[4]], 16) #若這 operand在 symbol_table 裡有定義，就把它的地址拿來當 entry_point。
+            entry_point = symbol_table[end_record[4]] #若這 operand在 symbol_table 裡有定義，就把它的地址拿來當 entry_point。
         else:
             print(f"Warning: END 指令的運算元 {end_record[4]} 未定義，使用程式起始位址") #若沒定義，就印警告。保留預設的 program_start_address。
     
-    for record in intermediate: #逐行取出中間檔的每筆記錄，各欄位依序拆給對應變數。
+    # 先把中間檔轉成一串 (位址, 目的碼, 可否拆開)；RESW/RESB 造成的空隙由 pack_text_records 依位址判斷
+    text_codes = []
+    for record, symbols in iter_with_symbols(intermediate, symbol_table): #逐行取出中間檔的每筆記錄，各欄位依序拆給對應變數。
         line_num, loc_hex, label, mnemonic, operand, opcode_hex, addressing = record
         
         # H/T/E 只放 Text Record，所以碰到 START/END 這種偽指令直接略過。
         if mnemonic in ["START", "END"]:
             continue
             
-        # Skip RESW and RESB (reserved space)RESW/RESB 也不產生機械碼，但它們中途會中斷 Text Record 流程：
+        # Skip RESW and RESB (reserved space)RESW/RESB 不產生機械碼；保留的空間會讓下一筆位址接不上，T record 自然在那裡斷開
         if mnemonic in ["RESW", "RESB"]:
-            if current_text:  # 如果已經在 current_text 累積程式碼，就先把它 flush（寫出一筆 T-record），
-                text_length = len(''.join(current_text)) // 2
-                # Format text record with spaces between object codes
-                text_content = ' '.join(current_text)
-                text_record = f"T {current_start_addr:06X} {text_length:02X} {text_content}"
-                object_records.append(text_record)
-                
-                # 再把 current_text 清空、current_start_addr 重設，下行繼續處理下一條。
-                current_text = [] 
-                current_start_addr = None
             continue
         
         # Generate object code for instruction
         # 呼叫前面那個 generate_object_code 函式，把助記符、operand、opcode_hex、addressing 全丟進去，取回 6 位元機器碼字串。
-        obj_code = generate_object_code(operand, opcode_hex, symbol_table, addressing)
+        # symbols 是這一批記錄用到的符號，事先用 lookup_many 一次查好
+        obj_code = generate_object_code(operand, opcode_hex, symbols, addressing)
         if obj_code is None:
             continue #回傳 None，表示這行不產生機器碼（或格式錯），就跳下一行。
-        
 
-        # 如果 current_text 剛好是空（上一筆 T-record 已經 flush 或才剛開始），就把這行的位址當成這筆 Text Record 的起始地址 current_start_addr。
-        if current_start_addr is None:
-            current_start_addr = int(loc_hex, 16)
-        
-        # Check if adding this code would exceed maximum text record length (30 bytes)
-        # Note: Now we need to consider actual object code length, not string length
-        # 每 2 個 hex 字元 才等於 1 個位元組，所以要 len(hex_str)//2 才能拿到「實際佔用的位元組數」，才能正確控制一條 T-record 最多 30 bytes。
-        current_length = sum(len(code.replace(" ", "")) // 2 for code in current_text) #已累積的機碼共多少 bytes。
-        new_code_length = len(obj_code.replace(" ", "")) // 2 #這行機碼幾 bytes。
-        
-        if current_length + new_code_length > 30: # 如果加起來會超過 30，必須先 flush目前的那筆 T-record：
-            # Output current text record and start new one
-            text_length = current_length
-            text_content = ' '.join(current_text)
-            text_record = f"T {current_start_addr:06X} {text_length:02X} {text_content}"
-            object_records.append(text_record) # 把這筆 T-record 加到 object_records。
-            current_text = [] #重設 current_text，把這行的位址當下一筆的新起始位址。
-            current_start_addr = int(loc_hex, 16)
-        
-        current_text.append(obj_code)
-    
-    # Output final text record if any
-    if current_text:
-        text_length = sum(len(code.replace(" ", "")) // 2 for code in current_text)
-        text_content = ' '.join(current_text)
-        text_record = f"T {current_start_addr:06X} {text_length:02X} {text_content}"
-        object_records.append(text_record) # 把這筆 T-record 加到 object_records。
+        # 只有資料 (BYTE/WORD) 可以拆開，指令的 3 bytes 一定要放在同一筆 T record
+        text_codes.append((int(loc_hex, 16), obj_code, mnemonic in ["BYTE", "WORD"]))
+
+    object_records.extend(pack_text_records(text_codes, strategy, max_record_length))
     
     # Generate End record with entry point
     end_record = f"E {entry_point:06X}" # 最後一行 E entry，entry point 用之前算好的 entry_point，補成 6 位 hex。
@@ -666,14 +1235,17 @@ def print_intermediate(intermediate):
         print(f"{line_num:4s}  {loc_hex:6s} {label:8s} {mnemonic:8s} {operand:10s} {opcode_hex:6s} {addressing}") #定址方式不設寬度，直接印出。
     print("-" * 60)
 
-def passTwo(symbol_table, intermediate, operandConfirm): 
+def passTwo(symbol_table, intermediate, operandConfirm, strategy="greedy", max_record_length=DEFAULT_TEXT_RECORD_LENGTH,
+            output_file='passTwo_output.txt'): 
     # symbol_table：Pass 1 存好的標籤→位址對照。
 	# intermediate：Pass 1 的中間檔，每行已解析好的欄位。
 	# operandConfirm：Pass 1 蒐集的、之後要檢查是否在符號表裡的操作數清單。
+	# strategy / max_record_length：T record 的打包策略和每筆最多幾 bytes。
+	# output_file：目的碼要寫入的檔案。
     """
     passTwo 做「找不到 symbol」的檢查，
-    如果所有 operandConfirm 中的 base_operand 不在 symbol_table，就報錯。
-    成功後產生目的碼。
+    如果所有 operandConfirm 中的 base_operand 不在 symbol_table，就報錯並回傳 False（不產生目的碼）。
+    成功後產生目的碼並回傳 True。
     """
     errors2 = []
     
@@ -681,93 +1253,172 @@ def passTwo(symbol_table, intermediate, operandConfirm):
     print("Label   Address")
     print("-" * 20)
     for label, addr in symbol_table.items():
-        print(f"{label:8s} {addr}")
+        print(f"{label:8s} {addr:04X}")
     print("-" * 20)
 
     print("\n==== Operand Confirmation ====")
     print("Line  Symbol")
     print("-" * 20)
     for ln, sym in operandConfirm:
-        print(f"{ln:4d}  {sym}")
+        print(f"{str(ln):>4s}  {sym}") # 被引入檔案的行號是 "檔名:行號" 字串
     print("-" * 20)
 
     print_intermediate(intermediate)
     
 
-    for ln, sym in operandConfirm: #針對每個待確認的 base_operand
+    for i in range(0, len(operandConfirm), SYMBOL_BATCH_SIZE): # 每一批待確認的符號用 lookup_many 一次查好
+        batch = operandConfirm[i:i+SYMBOL_BATCH_SIZE]
         # split the sym to get the label if it is indexed addressing
-        if ',' in sym: # 索引定址：操作數裡有逗號，格式通常是 LABEL,X。
-            sym = sym.split(',')[0] # 取逗號前面真正的符號名稱，例如 "BUFFER,X" → "BUFFER"。
-        if sym not in symbol_table: # 如果這個符號不在 symbol_table 裡，就報錯。
-            errors2.append(f"[passTwo] 錯誤：第 {ln} 行使用了未定義的符號 {sym}。")
+        # 索引定址：操作數裡有逗號，格式通常是 LABEL,X，取逗號前面真正的符號名稱，例如 "BUFFER,X" → "BUFFER"。
+        defined = symbol_table.lookup_many(sym.split(',')[0] for ln, sym in batch)
+        for ln, sym in batch: #針對每個待確認的 base_operand
+            sym = sym.split(',')[0]
+            if sym not in defined: # 如果這個符號不在 symbol_table 裡，就報錯。
+                errors2.append(f"[passTwo] 錯誤：第 {ln} 行使用了未定義的符號 {sym}。")
 
     if errors2:
         print("\n==== passTwo 發現的錯誤 ====")
         for e in errors2:
             print(e)
-        sys.exit(1)
+        return False # 交給呼叫端決定要不要結束；一次組譯多個程式時，其他程式還是要繼續
 
     # 產生目的碼
     print("\n==== 產生目的碼 ====")
-    object_program = generate_object_program(symbol_table, intermediate)
+    object_program = generate_object_program(symbol_table, intermediate, strategy, max_record_length)
     
     # 寫入目的碼檔案
-    with open('passTwo_output.txt', 'w') as f:
+    with open(output_file, 'w') as f:
         for record in object_program:
             print(record)
             f.write(record + '\n')
 
-    print("\n目的碼已寫入 passTwo_output.txt")
+    print(f"\n目的碼已寫入 {output_file}")
+    return True
 
 # ===================================================================================
 #                                      Main
 # ===================================================================================
 if __name__ == "__main__":
-    if len(sys.argv) < 2: #使用者沒有提供「要組譯的檔案名稱」。
-        print("Usage: python3 SIC_twoPass.py <source_file>")
-        sys.exit(1)
-
-    source_file = sys.argv[1] #把使用者在命令列輸入的第一個參數（通常是原始程式檔名）存到 source_file。
+    parser = argparse.ArgumentParser(description="SIC Two-Pass Assembler")
+    parser.add_argument("source_files", nargs='*', metavar="source_file",
+                        help="要組譯的原始程式檔，可以一次給多個 (INCLUDE 的檔案只會斷詞一次)")
+    parser.add_argument("--resume", metavar="INTERMEDIATE",
+                        help=f"跳過 passOne，直接從先前產生的中間檔 (例如 {INTERMEDIATE_FILE}) 執行 passTwo")
+    parser.add_argument("--pack", choices=PACK_STRATEGIES, default="greedy",
+                        help="T record 打包策略：greedy 為原本的作法，maxfill 會拆開 BYTE/WORD 把每筆 T record 塞滿")
+    parser.add_argument("--max-record-length", type=int, default=DEFAULT_TEXT_RECORD_LENGTH, metavar="BYTES",
+                        help=f"每筆 T record 最多幾 bytes (預設 {DEFAULT_TEXT_RECORD_LENGTH}，最大 {MAX_TEXT_RECORD_LENGTH})")
+    parser.add_argument("--symbol-store", choices=SYMBOL_STORES, default="memory",
+                        help="符號表存放方式：memory 放在記憶體，sqlite 存在磁碟上 (label 非常多時使用)")
+    parser.add_argument("--symbol-db", metavar="PATH",
+                        help="--symbol-store sqlite 使用的資料庫檔案 (預設為暫存檔，結束時刪除)")
+    parser.add_argument("--strip-unreachable", action="store_true",
+                        help="passTwo 前刪除從 END 入口點走不到、也沒有人參照的程式碼和資料，並重新分配位址")
+    args = parser.parse_args()
+    if bool(args.source_files) == bool(args.resume): # 原始程式檔和 --resume 必須剛好給一個
+        parser.error("請給要組譯的原始程式檔，或用 --resume 指定中間檔 (兩者擇一)")
+    if not 3 <= args.max_record_length <= MAX_TEXT_RECORD_LENGTH:
+        parser.error(f"--max-record-length 必須介於 3 到 {MAX_TEXT_RECORD_LENGTH}")
+
+    if args.resume:
+        jobs = [None] # 只需要中間檔就能執行 passTwo，不必重新讀 opCode.txt 和原始程式
+    else:
+        jobs = args.source_files
+
+        # 先建立 opcode_table(要確保和 opCode.txt 在同一資料夾
+        opcode_table = {}
+        try:
+            with open("opCode.txt", 'r') as f:
+                for line in f:
+                    line = line.strip() # 去掉前後空白
+                    if not line: # 如果這行是空行，就跳過。
+                        continue
+                    parts = line.split() # 用空白分隔，parts[0] 是助記符，parts[1] 是對應的 hex 字串。
+                    if len(parts) >= 2:
+                        mnem = parts[0].upper() # 助記符轉大寫
+                        code = parts[1].upper() # 機器碼轉大寫
+                        opcode_table[mnem] = code  # 把這對助記符和機器碼存到 opcode_table 裡。
+        except FileNotFoundError:
+            print("找不到 opCode.txt，請放在相同目錄下")
+            sys.exit(1)
+
+    failed = [] # 組譯失敗的原始程式；全部跑完才一起回報
+    for source_file in jobs:
+        # 一次組譯多個程式時，輸出檔名前面加上原始檔名，避免互相覆蓋
+        if len(jobs) > 1:
+            output_prefix = os.path.splitext(os.path.basename(source_file))[0] + "_"
+            print(f"\n==== {source_file} ====")
+        else:
+            output_prefix = ""
 
-    # 先建立 opcode_table(要確保和 opCode.txt 在同一資料夾
-    opcode_table = {}
-    try:
-        with open("opCode.txt", 'r') as f:
-            for line in f:
-                line = line.strip() # 去掉前後空白
-                if not line: # 如果這行是空行，就跳過。
-                    continue
-                parts = line.split() # 用空白分隔，parts[0] 是助記符，parts[1] 是對應的 hex 字串。
-                if len(parts) >= 2:
-                    mnem = parts[0].upper() # 助記符轉大寫
-                    code = parts[1].upper() # 機器碼轉大寫
-                    opcode_table[mnem] = code  # 把這對助記符和機器碼存到 opcode_table 裡。
-    except FileNotFoundError:
-        print("找不到 opCode.txt，請放在相同目錄下")
-        sys.exit(1)
-
-    # passOne
-    # 呼叫 passOne，把「源碼程式檔名」和「opcode_table」丟進去
-    symbol_table, intermediate, operandConfirm, pass1_errors = passOne(source_file, opcode_table)
-    #得到：
-    # 1. symbol_table：標籤→位址對照表
-    # 2. intermediate：中間檔記錄（已解析出的各欄位陣列）
-    # 3. operandConfirm：需要在 Pass 2 再確認的操作數清單
-    # 4. pass1_errors：Pass 1 檢查過程中蒐集到的錯誤訊息    
-
-    # 不論 passOne 有無錯，都先把 pass1_errors 列出來
-    if pass1_errors:
-        print("==== passOne 發現的錯誤 ====")
-        for e in pass1_errors:
+        try:
+            symbol_table = create_symbol_store(args.symbol_store, args.symbol_db)
+        except ValueError as e: # 別人的資料庫，拒絕覆蓋
             print(e)
-
-    # 再執行 passTwo，一次檢查所有未定義符號
-    passTwo(symbol_table, intermediate, operandConfirm)
-    # 負責︰
-    # 1. 印出符號表(symbol_table)、中間檔(intermediate)、操作數清單(operandConfirm)
-    # 2. 檢查 operandConfirm 裡面所有符號是否都在 symbol_table
-    # 3. 若有未定義就印錯誤並 sys.exit(1)；否則才正式產出目標程式（H/T/E）。
-
-
-    # 若到這裡都沒 exit，表示 passTwo 也沒找到「使用未定義符號」
-    # （後續才可以做真正的物件碼組合 H/T/E，如果需要就自行加上去）
\ No newline at end of file
+            sys.exit(1)
+        except sqlite3.Error as e: # 不是資料庫或無法開啟
+            print(f"無法開啟符號表資料庫 {args.symbol_db}: {e}")
+            sys.exit(1)
+        try:
+            if source_file is None:
+                try:
+                    symbol_table, intermediate, operandConfirm, pass1_errors = load_intermediate(args.resume, symbol_table)
+                except FileNotFoundError:
+                    print(f"找不到中間檔 {args.resume}")
+                    sys.exit(1)
+                except ValueError as e:
+                    print(e)
+                    sys.exit(1)
+            else:
+                # passOne
+                # 呼叫 passOne，把「源碼程式檔名」和「opcode_table」丟進去
+                try:
+                    symbol_table, intermediate, operandConfirm, pass1_errors = passOne(
+                        source_file, opcode_table, symbol_table, output_prefix + 'passOne_output.txt')
+                except FileNotFoundError:
+                    print(f"找不到原始程式檔 {source_file}")
+                    failed.append(source_file)
+                    continue
+                #得到：
+                # 1. symbol_table：標籤→位址對照表
+                # 2. intermediate：中間檔記錄（已解析出的各欄位陣列）
+                # 3. operandConfirm：需要在 Pass 2 再確認的操作數清單
+                # 4. pass1_errors：Pass 1 檢查過程中蒐集到的錯誤訊息
+
+                # 把 passOne 的結果存成中間檔，之後可以用 --resume 直接跑 passTwo
+                save_intermediate(output_prefix + INTERMEDIATE_FILE, symbol_table, intermediate, operandConfirm, pass1_errors)
+
+            # 不論 passOne 有無錯，都先把 pass1_errors 列出來
+            if pass1_errors:
+                print("==== passOne 發現的錯誤 ====")
+                for e in pass1_errors:
+                    print(e)
+
+            # 選用：刪掉用不到的程式碼和資料，重新分配位址（存下來的中間檔仍是 passOne 的原始結果）
+            # passOne 有錯時，錯誤的行不會移動位址，用位址差算出的大小不可靠，所以不做
+            if args.strip_unreachable and pass1_errors:
+                print("\npassOne 有錯誤，略過 --strip-unreachable")
+            elif args.strip_unreachable:
+                intermediate, operandConfirm, _ = eliminate_unreachable(symbol_table, intermediate, operandConfirm)
+
+            # 再執行 passTwo，一次檢查所有未定義符號
+            if not passTwo(symbol_table, intermediate, operandConfirm, args.pack, args.max_record_length,
+                           output_prefix + 'passTwo_output.txt'):
+                failed.append(source_file if source_file is not None else args.resume)
+            # 負責︰
+            # 1. 印出符號表(symbol_table)、中間檔(intermediate)、操作數清單(operandConfirm)
+            # 2. 檢查 operandConfirm 裡面所有符號是否都在 symbol_table
+            # 3. 若有未定義就印錯誤並回傳 False（記在 failed，繼續下一個程式）；否則才正式產出目標程式（H/T/E）。
+        except sqlite3.Error as e: # 組譯途中資料庫出錯（例如磁碟滿了）
+            print(f"符號表資料庫錯誤: {e}")
+            sys.exit(1)
+        finally:
+            symbol_table.close() # sqlite 符號表用的暫存檔在這裡刪除
+
+    # 全部程式都跑完後，只要有一個失敗就以非 0 結束
+    if failed:
+        if len(jobs) > 1:
+            print(f"\n==== 組譯失敗的程式 ({len(failed)}/{len(jobs)}) ====")
+            for name in failed:
+                print(name)
+        sys.exit(1)
\ No newline at end of file
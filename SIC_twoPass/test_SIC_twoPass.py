@@ -0,0 +1,354 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import SIC_twoPass
+from SIC_twoPass import (SQLiteSymbolStore, create_symbol_store, eliminate_unreachable, generate_object_program,
+                         lex_source_cached, load_intermediate, pack_text_records, passOne, passTwo, save_intermediate)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_opcode_table():
+    """讀取和主程式同一資料夾的 opCode.txt"""
+    opcode_table = {}
+    with open(os.path.join(HERE, "opCode.txt")) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2:
+                opcode_table[parts[0].upper()] = parts[1].upper()
+    return opcode_table
+
+
+class SourceTestCase(unittest.TestCase):
+    """在暫存資料夾裡放原始檔，跑 passOne 時不把輸出檔寫到目前目錄，也不印出結果"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.opcode_table = load_opcode_table()
+
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def pass_one(self, name, symbol_table=None):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return passOne(os.path.join(self.dir, name), self.opcode_table, symbol_table,
+                           os.path.join(self.dir, "passOne_output.txt"))
+
+
+def record_lengths(text_records):
+    """取出每筆 T record 的長度欄位"""
+    return [int(record.split()[2], 16) for record in text_records]
+
+
+class PackTextRecordsTest(unittest.TestCase):
+    # 兩條指令 + 一個 46 bytes 的 C'...'（passOne 會切成 30 + 16 bytes 兩段）
+    TEXT_CODES = [
+        (0x1000, "001006", False),
+        (0x1003, "001006", False),
+        (0x1006, "41" * 30, True),
+        (0x1024, "42" * 16, True),
+    ]
+
+    def test_greedy_respects_max_record_length(self):
+        records = pack_text_records(self.TEXT_CODES, "greedy", 10)
+        self.assertTrue(all(length <= 10 for length in record_lengths(records)), records)
+        self.assertEqual(sum(record_lengths(records)), 52)
+
+    def test_maxfill_respects_max_record_length(self):
+        records = pack_text_records(self.TEXT_CODES, "maxfill", 10)
+        self.assertEqual(record_lengths(records), [10, 10, 10, 10, 10, 2])
+
+    def test_greedy_default_length_unchanged(self):
+        records = pack_text_records(self.TEXT_CODES, "greedy")
+        self.assertEqual(record_lengths(records), [6, 30, 16])
+
+    def test_breaks_only_on_address_gap(self):
+        text_codes = [(0x0, "000003", False), (0x3, "000001", False), (0x9, "000002", False), (0xC, "000004", False)]
+        self.assertEqual(pack_text_records(text_codes), ["T 000000 06 000003 000001", "T 000009 06 000002 000004"])
+
+
+class GenerateObjectProgramTest(SourceTestCase):
+    def test_zero_size_reserve_does_not_split_text_record(self):
+        self.write("z.asm", "C START 0\nFIRST LDA Z\nZ WORD 1\nG RESB 0\nW WORD 2\n END FIRST\n")
+        symbol_table, intermediate, operandConfirm, errors = self.pass_one("z.asm")
+        self.assertEqual(errors, [])
+        object_program = generate_object_program(symbol_table, intermediate)
+        self.assertEqual(object_program[1:], ["T 000000 09 000003 000001 000002", "E 000000"])
+
+    def test_reserved_space_splits_text_record(self):
+        self.write("r.asm", "C START 0\nFIRST LDA Z\nZ WORD 1\nG RESW 2\nW WORD 2\n END FIRST\n")
+        symbol_table, intermediate, operandConfirm, errors = self.pass_one("r.asm")
+        object_program = generate_object_program(symbol_table, intermediate)
+        self.assertEqual(object_program[1:3], ["T 000000 06 000003 000001", "T 00000C 03 000002"])
+
+
+class LoadIntermediateTest(unittest.TestCase):
+    def load(self, data):
+        fd, path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        try:
+            return load_intermediate(path)
+        finally:
+            os.remove(path)
+
+    def test_missing_fields_raise_value_error(self):
+        with self.assertRaises(ValueError):
+            self.load({"format": "sic-intermediate", "version": 1})
+
+    def test_wrong_field_types_raise_value_error(self):
+        with self.assertRaises(ValueError):
+            self.load({"format": "sic-intermediate", "version": 1,
+                       "program": {"start_address": 0, "end_address": 0, "end_loc": 0, "length": 0},
+                       "symbol_table": {"A": "ZZZZ"}, "intermediate": [], "operand_confirm": [], "errors": []})
+
+
+class IntermediateRoundTripTest(SourceTestCase):
+    GLOBALS = ("program_start_address", "program_end_address", "program_end_loc", "program_length")
+
+    def round_trip(self, kind, name):
+        """passOne → save_intermediate → load_intermediate，回傳直接跑和讀回來的兩份結果"""
+        direct = self.pass_one(name, create_symbol_store(kind))
+        self.addCleanup(direct[0].close)
+        program = {key: getattr(SIC_twoPass, key) for key in self.GLOBALS}
+        path = os.path.join(self.dir, "passOne_output.json")
+        save_intermediate(path, *direct)
+        for key in self.GLOBALS: # 確定全域變數是 load_intermediate 還原的，不是沿用 passOne 留下的
+            setattr(SIC_twoPass, key, 0)
+        loaded = load_intermediate(path, create_symbol_store(kind))
+        self.addCleanup(loaded[0].close)
+        self.assertEqual({key: getattr(SIC_twoPass, key) for key in self.GLOBALS}, program)
+        return direct, loaded
+
+    def pass_two(self, result, output_name):
+        symbol_table, intermediate, operandConfirm, errors = result
+        output_file = os.path.join(self.dir, output_name)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(passTwo(symbol_table, intermediate, operandConfirm, output_file=output_file))
+        with open(output_file) as f:
+            return f.read()
+
+    def test_round_trip_matches_direct_run(self):
+        self.write("main.asm", "P START 1000\nF JSUB RTN\n INCLUDE 'lib/sub.asm'\n J F\nS BYTE C'A B'\n END F\n")
+        self.write("lib/sub.asm", "RTN LDA ONE\n RSUB\nONE WORD 1\n")
+        for kind in ("memory", "sqlite"):
+            with self.subTest(kind=kind):
+                direct, loaded = self.round_trip(kind, "main.asm")
+                self.assertEqual(dict(loaded[0].items()), dict(direct[0].items()))
+                self.assertEqual(loaded[1:], direct[1:])
+                # 被引入檔案的行號是 "檔名:行號" 字串，讀回來要維持原樣
+                self.assertIn(["lib/sub.asm:1", "ONE"], loaded[2])
+                program = {key: getattr(SIC_twoPass, key) for key in self.GLOBALS}
+                self.assertEqual(generate_object_program(loaded[0], loaded[1]),
+                                 generate_object_program(direct[0], direct[1]))
+                self.assertEqual(self.pass_two(loaded, "loaded.txt"), self.pass_two(direct, "direct.txt"))
+                self.assertEqual({key: getattr(SIC_twoPass, key) for key in self.GLOBALS}, program)
+
+    def test_round_trip_keeps_errors(self):
+        self.write("bad.asm", "P START 0\nF RSUB\nF RSUB\nX WORD Q\n END F\n")
+        for kind in ("memory", "sqlite"):
+            with self.subTest(kind=kind):
+                direct, loaded = self.round_trip(kind, "bad.asm")
+                self.assertTrue(direct[3])
+                self.assertEqual(loaded[3], direct[3])
+                self.assertEqual(dict(loaded[0].items()), dict(direct[0].items()))
+
+
+class SQLiteSymbolStoreTest(unittest.TestCase):
+    def test_duplicates_across_batches(self):
+        store = SQLiteSymbolStore(batch_size=2)
+        try:
+            self.assertTrue(store.define("A", 0x1000, 1))
+            self.assertTrue(store.define("B", 0x1003, 2)) # 滿一批，寫進資料庫
+            self.assertTrue(store.define("A", 0x1006, 3)) # 和資料庫裡的 A 重複，flush 時才發現
+            self.assertFalse(store.define("A", 0x1009, 4)) # 和暫存中的 A 重複，馬上發現
+            store.flush()
+            self.assertEqual(store.take_duplicates(), [("A", 3)])
+            self.assertEqual(list(store.items()), [("A", 0x1000), ("B", 0x1003)])
+        finally:
+            store.close()
+
+    def test_refuses_foreign_database(self):
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try:
+            conn = sqlite3.connect(path)
+            conn.execute("CREATE TABLE symbols (x)")
+            conn.execute("INSERT INTO symbols VALUES (1)")
+            conn.commit()
+            conn.close()
+            with self.assertRaises(ValueError):
+                SQLiteSymbolStore(path)
+            conn = sqlite3.connect(path)
+            self.assertEqual(conn.execute("SELECT x FROM symbols").fetchall(), [(1,)]) # 資料沒有被刪掉
+            conn.close()
+        finally:
+            os.remove(path)
+
+
+class IncludeCacheTest(unittest.TestCase):
+    OPCODES = {"LDA": "00"}
+
+    def test_changed_file_replaces_cached_entry(self):
+        fd, path = tempfile.mkstemp(suffix=".txt")
+        os.close(fd)
+        try:
+            with open(path, 'w') as f:
+                f.write("A LDA B\n")
+            first = lex_source_cached(path, self.OPCODES)
+            self.assertIs(lex_source_cached(path, self.OPCODES), first) # 沒改過就直接用快取
+
+            with open(path, 'w') as f:
+                f.write("A LDA B\nC WORD X\n")
+            os.utime(path, ns=(0, 0)) # 確保 mtime 不同
+            second = lex_source_cached(path, self.OPCODES)
+            self.assertEqual(len(second), 2)
+            self.assertEqual(second[1][1][4], (False, "WORD 指令的運算元必須是十進位數字，不能是 X")) # 驗證結果一起快取
+            self.assertIs(SIC_twoPass._include_cache[os.path.abspath(path)][1], second) # 舊的那份已被取代
+        finally:
+            SIC_twoPass._include_cache.pop(os.path.abspath(path), None)
+            os.remove(path)
+
+
+class PassOneTest(SourceTestCase):
+    def test_unknown_opcode_is_reported(self):
+        self.write("a.asm", "P START 0\nFIRST FOO BAR\n END P\n")
+        symbol_table, intermediate, operandConfirm, errors = self.pass_one("a.asm")
+        self.assertIn("無效的 Opcode (FIRST) in line : 2", errors)
+        self.assertEqual([record[3] for record in intermediate], ["START", "END"])
+
+    def test_unknown_single_token_is_reported(self):
+        self.write("a.asm", "P START 0\nFOO\n END P\n")
+        errors = self.pass_one("a.asm")[3]
+        self.assertIn("無效的指令 (FOO) in line : 2", errors)
+
+
+class IncludeTest(SourceTestCase):
+    def test_nested_include_resolves_relative_paths(self):
+        self.write("main.asm", "P START 1000\nF JSUB RTN\n INCLUDE 'lib/sub.asm'\n END F\n")
+        self.write("lib/sub.asm", "RTN LDA ONE\n RSUB\n INCLUDE 'data.asm'\n") # data.asm 相對於 lib/
+        self.write("lib/data.asm", ". 共用資料\nONE WORD 1\n")
+        symbol_table, intermediate, operandConfirm, errors = self.pass_one("main.asm")
+        self.assertEqual(errors, [])
+        self.assertEqual(dict(symbol_table.items()), {"P": 0x1000, "F": 0x1000, "RTN": 0x1003, "ONE": 0x1009})
+        # 被引入檔案的行號寫成 "檔名:行號"
+        self.assertEqual([(record[0], record[1], record[3]) for record in intermediate], [
+            ("1", "1000", "START"), ("2", "1000", "JSUB"), ("3", "1003", "INCLUDE"),
+            ("lib/sub.asm:1", "1003", "LDA"), ("lib/sub.asm:2", "1006", "RSUB"), ("lib/sub.asm:3", "1009", "INCLUDE"),
+            ("data.asm:2", "1009", "WORD"), ("4", "100C", "END"),
+        ])
+        self.assertEqual(operandConfirm, [[2, "RTN"], ["lib/sub.asm:1", "ONE"], [4, "F"]])
+
+    def test_start_or_end_in_included_file_is_an_error(self):
+        self.write("main.asm", "P START 0\nF RSUB\n INCLUDE 'bad.asm'\n END F\n")
+        self.write("bad.asm", "X START 0\n END X\n")
+        errors = self.pass_one("main.asm")[3]
+        self.assertIn("INCLUDE 的檔案不能有 START 指令 in line : bad.asm:1", errors)
+        self.assertIn("INCLUDE 的檔案不能有 END 指令 in line : bad.asm:2", errors)
+
+    def test_cyclic_include_is_an_error(self):
+        self.write("main.asm", "P START 0\nF RSUB\n INCLUDE 'a.asm'\n END F\n")
+        self.write("a.asm", "A RSUB\n INCLUDE 'b.asm'\n")
+        self.write("b.asm", "B RSUB\n INCLUDE 'a.asm'\n")
+        symbol_table, intermediate, operandConfirm, errors = self.pass_one("main.asm")
+        self.assertEqual(errors, ["INCLUDE 的檔案 a.asm 形成循環引入 in line : b.asm:2"])
+        self.assertEqual(dict(symbol_table.items()), {"P": 0, "F": 0, "A": 3, "B": 6})
+
+    def test_missing_include_is_an_error(self):
+        self.write("main.asm", "P START 0\nF RSUB\n INCLUDE 'nope.asm'\n END F\n")
+        errors = self.pass_one("main.asm")[3]
+        self.assertEqual(errors, ["找不到 INCLUDE 的檔案 nope.asm in line : 3"])
+
+
+class EliminateUnreachableTest(SourceTestCase):
+    def strip(self, name):
+        symbol_table, intermediate, operandConfirm, errors = self.pass_one(name)
+        self.assertEqual(errors, [])
+        with contextlib.redirect_stdout(io.StringIO()):
+            intermediate, operandConfirm, saved = eliminate_unreachable(symbol_table, intermediate, operandConfirm)
+        return symbol_table, intermediate, operandConfirm, saved
+
+    def test_removes_dead_code_and_unused_data(self):
+        self.write("d.asm", "\n".join([
+            "P START 1000",
+            "FIRST JSUB RTN",
+            " J DONE",
+            "DEAD LDA TBL",   # J 之後不會往下執行
+            " RSUB",
+            "RTN LDA TBL",
+            " RSUB",
+            "DEAD2 LDA ONE",  # RSUB 之後不會往下執行，也沒人參照
+            "DONE J DONE",
+            "TBL WORD 5",
+            " WORD 6",        # 沒有 label 的資料延續 TBL
+            "TBL2 RESW 10",   # 有 label 的資料不延續
+            "ONE WORD 1",     # 只有死掉的程式碼參照
+            " END FIRST",
+        ]) + "\n")
+        symbol_table, intermediate, operandConfirm, saved = self.strip("d.asm")
+        self.assertEqual([(record[0], record[1], record[2], record[3]) for record in intermediate], [
+            ("1", "1000", "P", "START"), ("2", "1000", "FIRST", "JSUB"), ("3", "1003", "***", "J"),
+            ("6", "1006", "RTN", "LDA"), ("7", "1009", "***", "RSUB"), ("9", "100C", "DONE", "J"),
+            ("10", "100F", "TBL", "WORD"), ("11", "1012", "***", "WORD"), ("14", "1015", "***", "END"),
+        ])
+        self.assertEqual(dict(symbol_table.items()),
+                         {"P": 0x1000, "FIRST": 0x1000, "RTN": 0x1006, "DONE": 0x100C, "TBL": 0x100F})
+        self.assertEqual(operandConfirm, [[2, "RTN"], [3, "DONE"], [6, "TBL"], [9, "DONE"], [14, "FIRST"]])
+        self.assertEqual(saved, 0x3F - 0x15)
+        self.assertEqual(SIC_twoPass.program_length, 0x15)
+        object_program = generate_object_program(symbol_table, intermediate)
+        self.assertEqual(object_program, ["H P      001000 000015",
+                                          "T 001000 15 481006 3C100C 00100F 4C0000 3C100C 000005 000006",
+                                          "E 001000"])
+
+    def test_undefined_end_label_starts_after_start(self):
+        self.write("e.asm", "P START 0\nA LDA X\n RSUB\nB RSUB\nX WORD 1\n END NOPE\n")
+        symbol_table, intermediate, operandConfirm, saved = self.strip("e.asm")
+        self.assertEqual([record[2] for record in intermediate], ["P", "A", "***", "X", "***"])
+        self.assertEqual(dict(symbol_table.items()), {"P": 0, "A": 0, "X": 6})
+        self.assertEqual(saved, 3)
+
+    def test_skipped_when_pass_one_has_errors(self):
+        shutil.copy(os.path.join(HERE, "opCode.txt"), self.dir)
+        self.write("bad.asm", "P START 0\nF J F\nX WORD Q\nY RESW 2\n END F\n")
+        result = subprocess.run([sys.executable, os.path.join(HERE, "SIC_twoPass.py"), "bad.asm", "--strip-unreachable"],
+                                cwd=self.dir, capture_output=True, text=True)
+        self.assertIn("passOne 有錯誤，略過 --strip-unreachable", result.stdout)
+        self.assertNotIn("Dead Code Elimination", result.stdout)
+
+
+class BatchTest(SourceTestCase):
+    def test_pass_two_reports_failure_instead_of_exiting(self):
+        self.write("u.asm", "P START 0\nF LDA Z\n END F\n")
+        symbol_table, intermediate, operandConfirm, errors = self.pass_one("u.asm")
+        output_file = os.path.join(self.dir, "passTwo_output.txt")
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertFalse(passTwo(symbol_table, intermediate, operandConfirm, output_file=output_file))
+        self.assertFalse(os.path.exists(output_file))
+
+    def test_batch_continues_after_failed_source(self):
+        shutil.copy(os.path.join(HERE, "opCode.txt"), self.dir)
+        self.write("u.asm", "P START 0\nF LDA Z\n END F\n") # Z 未定義
+        self.write("a.asm", "P START 0\nF LDA O\nO WORD 1\n END F\n")
+        result = subprocess.run([sys.executable, os.path.join(HERE, "SIC_twoPass.py"), "u.asm", "a.asm"],
+                                cwd=self.dir, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 1)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "u_passTwo_output.txt")))
+        with open(os.path.join(self.dir, "a_passTwo_output.txt")) as f:
+            self.assertEqual(f.read().splitlines(), ["H P      000000 000006", "T 000000 06 000003 000001", "E 000000"])
+
+
+if __name__ == "__main__":
+    unittest.main()